@@ -4,12 +4,81 @@
 # Author: Dan Furie
 # https://github.com/djfurie/GeoTIFF2Rhino
 
-from struct import unpack
+import mmap
+import os
+from collections import OrderedDict
+from struct import unpack, Struct
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    # concurrent.futures does not exist on IronPython 2.7; region reads
+    # simply stay single-threaded there
+    ThreadPoolExecutor = None
+
+try:
+    import numpy as np
+except ImportError:
+    # NumPy is not available under IronPython, so the bulk readers
+    # fall back to (slower) pure-Python decoding when it is missing
+    np = None
+
+try:
+    import numba
+except ImportError:
+    # Numba is optional as well; when present, read_region decodes through
+    # a JIT-compiled kernel parallelized across rows
+    numba = None
+
+# Precompiled header structs so the format strings are parsed once at import
+# time rather than on every unpack call
+# All fields are explicitly little-endian, matching the 'II' TIFF byte order
+# (the native formats used before were also the wrong sizes on 64-bit Unix)
+_HDR_STRUCT = Struct('<hhi')
+_NUM_TAGS_STRUCT = Struct('<H')
+_TAG_STRUCT = Struct('<HHLL')
+_NEXT_IFD_STRUCT = Struct('<i')
+
+if numba is not None and np is not None:
+    @numba.njit(parallel=True, cache=True)
+    def _decode_region_jit(buf, tile_offsets, tiles_across, tw, tl, start_x, start_y, out):
+        """
+        Decodes a pixel region from the raw mapped file bytes into out
+
+        :param buf: The whole TIF file as a uint8 array (view of the mmap)
+        :param tile_offsets: Tile file offsets as an int64 array
+        :param tiles_across: Number of tiles per image row
+        :param tw: Tile width in pixels
+        :param tl: Tile length (height) in pixels
+        :param start_x: Upper left X pixel coordinate of the region
+        :param start_y: Upper left Y pixel coordinate of the region
+        :param out: Preallocated int16 output array to fill
+        :return: None
+        """
+        height, width = out.shape
+        for row in numba.prange(height):
+            y = start_y + row
+            tile_row = tile_offsets[(y // tl) * tiles_across:]
+            yt = y % tl
+            for col in range(width):
+                x = start_x + col
+                pixel_idx = tile_row[x // tw] + (yt * tw + x % tw) * 2
+
+                # Assemble the little-endian int16 by hand, with sign extension
+                val = (buf[pixel_idx + 1] << 8) | buf[pixel_idx]
+                if val >= 32768:
+                    val -= 65536
+                out[row, col] = val
 
 
 class TFWFile:
     """ Loads TFW world files and performs coordinate transforms """
 
+    # The attribute set is fixed, so skip the per-instance __dict__; attribute
+    # reads in the transform methods get cheaper and instances get smaller
+    __slots__ = ('x_res', 'y_res', 'origin_lat', 'origin_lon',
+                 '_sx', '_sy', '_inv_xres', '_inv_yres')
+
     def __init__(self, tfw_path):
         """
         :param tfw_path: Path to the TFW file to parse
@@ -27,16 +96,26 @@ class TFWFile:
         :param path: Path to the TFW file to parse
         :return: None
         """
-        f = open(path)
-
-        self.x_res = float(f.readline())
-        f.readline() # Rotation Parameter
-        f.readline() # Rotation Parameter
-        self.y_res = float(f.readline())
-        self.origin_lat = float(f.readline())
-        self.origin_lon = float(f.readline())
-
-        f.close()
+        # A TFW file is just six numbers, so read it in one go rather than
+        # with six buffered readline calls
+        with open(path) as f:
+            fields = f.read().split()
+
+        self.x_res = float(fields[0])
+        # Fields 1 and 2 are the rotation parameters, which are unused
+        self.y_res = float(fields[3])
+        self.origin_lat = float(fields[4])
+        self.origin_lon = float(fields[5])
+
+        # Precompute the pixel -> meters scale factors (see pixel_to_world)
+        # so per-call and vectorized transforms are a single multiply per axis
+        self._sx = self.x_res * 110e3
+        self._sy = self.y_res * 110e3
+
+        # Same idea for the reverse transform: cache the reciprocals so
+        # latlon_to_pixel_coord multiplies instead of dividing per call
+        self._inv_xres = 1.0 / self.x_res
+        self._inv_yres = 1.0 / self.y_res
 
     def pixel_to_world(self, x, y):
         """
@@ -51,24 +130,49 @@ class TFWFile:
         # Res is scaled in degrees, so we can only approximate
         # the distance in meters for Rhino
         # 1 degree latitude is 110km at the equator
-        x1 = self.x_res * 110e3 * x
-        y1 = self.y_res * 110e3 * y
+        x1 = self._sx * x
+        y1 = self._sy * y
         return x1, y1
 
+    def pixel_to_world_arr(self, xs, ys):
+        """
+        Vectorized version of pixel_to_world, using the same approximation
+
+        Accepts whole arrays of coordinates (NumPy ndarrays, or anything that
+        supports multiplication by a float) and transforms them with a single
+        multiply per axis instead of one Python call per pixel
+
+        :param xs: Array of X pixel coordinates from the associated GeoTIFF
+        :param ys: Array of Y pixel coordinates from the associated GeoTIFF
+        :return: (xs, ys) arrays of coordinates in meters, scaled according to the TFW file
+        """
+        return xs * self._sx, ys * self._sy
+
     def latlon_to_pixel_coord(self, lat, lon):
         """ Takes in a latitude and longitude and returns the pixel coordinates for that piece of land
         :param lat: Latitude in degrees
         :param lon: Longitude in degrees
         :return: (x,y) coordinates of the pixels in the GeoTIFF corresponding to the given lat,lon
         """
-        offset_lat = lat - self.origin_lat
-        offset_lon = lon - self.origin_lon
-
-        x = offset_lat / self.x_res
-        y = offset_lon / self.y_res
+        x = (lat - self.origin_lat) * self._inv_xres
+        y = (lon - self.origin_lon) * self._inv_yres
 
         return x, y
 
+    def latlon_to_pixel_coord_arr(self, lats, lons):
+        """
+        Vectorized version of latlon_to_pixel_coord
+
+        Accepts whole arrays of coordinates (NumPy ndarrays, or anything that
+        supports arithmetic with floats) and transforms them with a single
+        subtract and multiply per axis
+
+        :param lats: Array of latitudes in degrees
+        :param lons: Array of longitudes in degrees
+        :return: (x, y) arrays of pixel coordinates in the GeoTIFF corresponding to the given lats, lons
+        """
+        return (lats - self.origin_lat) * self._inv_xres, (lons - self.origin_lon) * self._inv_yres
+
 
 class TIFFFile:
     """ This TIFF parsing class does the bare minimum for getting pixel sample data from a GeoTIFF file
@@ -79,6 +183,22 @@ class TIFFFile:
         tif_path (str): Path to the *.tif file to load
     """
 
+    # As with TFWFile, a fixed attribute set means __slots__ can replace the
+    # per-instance __dict__, which matters for get_pixel_val's attribute reads
+    __slots__ = ('file_path', 'f', 'mm',
+                 'tiff_id', 'tiff_version', 'tiff_IFDOffset',
+                 'tiff_BitsPerSample', 'tiff_tilesAcross', 'tiff_tilesDown',
+                 'tiff_tileWidth', 'tiff_tileLength', 'tiff_tileOffsets',
+                 'tiff_ImageWidth', 'tiff_ImageHeight',
+                 '_tw', '_tl', '_tile_struct', '_tile_cache',
+                 '_use_shift', '_tw_shift', '_tw_mask', '_tl_shift', '_tl_mask')
+
+    # Number of decoded tiles kept around for get_pixel_val sampling
+    _TILE_CACHE_SIZE = 64
+
+    # Minimum number of tiles in a region read before threads are worth it
+    _PARALLEL_TILE_MIN = 4
+
     def __init__(self, tif_path):
         """
         Parses a TIF file so that pixel data can be read
@@ -87,6 +207,10 @@ class TIFFFile:
         self.file_path = tif_path
         self.f = open(tif_path, 'rb')
 
+        # Map the whole file read-only so pixel lookups become plain memory
+        # reads served from the OS page cache instead of seek/read syscalls
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+
         self.tiff_id = None
         self.tiff_version = None
         self.tiff_IFDOffset = None
@@ -98,6 +222,15 @@ class TIFFFile:
         self.tiff_tileOffsets = None
         self.tiff_ImageWidth = None
         self.tiff_ImageHeight = None
+        self._tw = None
+        self._tl = None
+        self._tile_struct = None
+        self._tile_cache = OrderedDict()
+        self._use_shift = False
+        self._tw_shift = None
+        self._tw_mask = None
+        self._tl_shift = None
+        self._tl_mask = None
 
         self.parse_header_info()
 
@@ -111,18 +244,28 @@ class TIFFFile:
             self.f.seek(0)
 
             # Read in the basic header information
-            (self.tiff_id, self.tiff_version, self.tiff_IFDOffset) = unpack('hhi', self.f.read(8))
+            (self.tiff_id, self.tiff_version, self.tiff_IFDOffset) = _HDR_STRUCT.unpack(self.f.read(8))
 
             # Seek to the start of the tags data
             self.f.seek(self.tiff_IFDOffset)
 
             # Determine the number of tags present
-            (num_tags,) = unpack('H', self.f.read(2))
+            (num_tags,) = _NUM_TAGS_STRUCT.unpack(self.f.read(2))
 
-            # Loop through the available tags
-            for tag in range(0, num_tags):
-                (tag_id, data_type, data_count, data_offset) = unpack('HHLL', self.f.read(12))
+            # Read the whole tag block in one go and decode it in memory;
+            # a 12-byte read per tag plus the seek-away-and-back for the
+            # tile offsets dominated header parsing on tag-heavy files
+            # (Struct.iter_unpack would read nicer, but it is Python 3 only)
+            tag_buf = self.f.read(num_tags * 12)
+            tags = [_TAG_STRUCT.unpack_from(tag_buf, i * 12) for i in range(num_tags)]
+
+            (next_idf_offset,) = _NEXT_IFD_STRUCT.unpack(self.f.read(4)) # Assume this is zero for basic usages
 
+            tile_offsets_pos = None
+            tile_offsets_count = 0
+
+            # Loop through the available tags
+            for (tag_id, data_type, data_count, data_offset) in tags:
                 # These tag_id's are specified in the TIFF spec: http://www.fileformat.info/format/tiff/egff.htm#TIFF.FO
                 if tag_id == 256:
                     self.tiff_ImageWidth = int(data_offset)
@@ -135,26 +278,46 @@ class TIFFFile:
                 elif tag_id == 323:
                     self.tiff_tileLength = int(data_offset)
                 elif tag_id == 324:
-                    # Save where the file pointer currently is
-                    current_file_position = self.f.tell()
-                    self.f.seek(data_offset)
-
-                    # Populate a list with all the tile offsets
-                    # Tiles are ordered left to right, top to bottom
-                    self.tiff_tileOffsets = []
-                    for i in range(0, data_count):
-                        data = self.f.read(4)
-                        (offset,) = unpack('L', data)
-                        self.tiff_tileOffsets.append(offset)
-
-                    # Restore the file pointer to where it was
-                    self.f.seek(current_file_position)
-
-            (next_idf_offset,) = unpack('i', self.f.read(4)) # Assume this is zero for basic usages
+                    # Just note where the offsets live; they are read in one
+                    # pass below so the tag scan stays free of I/O
+                    tile_offsets_pos = data_offset
+                    tile_offsets_count = data_count
+
+            if tile_offsets_pos is not None:
+                # Decode the whole tile offset array from one bulk read
+                # instead of a 4-byte read/unpack per tile
+                # Tiles are ordered left to right, top to bottom
+                self.f.seek(tile_offsets_pos)
+                offsets_buf = self.f.read(tile_offsets_count * 4)
+                if np is not None:
+                    self.tiff_tileOffsets = np.frombuffer(offsets_buf, dtype='<u4')
+                else:
+                    self.tiff_tileOffsets = unpack('<%dL' % tile_offsets_count, offsets_buf)
 
             # Calculate the image dimensions in terms of number of tiles- useful for later calculation
-            self.tiff_tilesAcross = (self.tiff_ImageWidth + (self.tiff_tileWidth - 1)) / self.tiff_tileWidth
-            self.tiff_tilesDown = (self.tiff_ImageHeight + (self.tiff_tileLength - 1)) / self.tiff_tileLength
+            # Floor division keeps these as ints; under Python 3, '/' would
+            # produce floats that break (and slow down) tile offset indexing
+            self.tiff_tilesAcross = (self.tiff_ImageWidth + (self.tiff_tileWidth - 1)) // self.tiff_tileWidth
+            self.tiff_tilesDown = (self.tiff_ImageHeight + (self.tiff_tileLength - 1)) // self.tiff_tileLength
+
+            # Keep int copies of the tile geometry handy for the hot paths
+            self._tw = int(self.tiff_tileWidth)
+            self._tl = int(self.tiff_tileLength)
+
+            # Precompiled whole-tile decoder for the pure-Python path
+            if np is None:
+                self._tile_struct = Struct('<%dh' % (self._tw * self._tl))
+
+            # Tile dimensions are multiples of 16 and in practice powers of
+            # two, in which case get_pixel_val can locate the tile and the
+            # pixel within it with shifts and masks instead of div/mod
+            self._use_shift = (self._tw & (self._tw - 1) == 0
+                               and self._tl & (self._tl - 1) == 0)
+            if self._use_shift:
+                self._tw_shift = self._tw.bit_length() - 1
+                self._tw_mask = self._tw - 1
+                self._tl_shift = self._tl.bit_length() - 1
+                self._tl_mask = self._tl - 1
 
     def get_pixel_val(self, x, y):
         """
@@ -162,21 +325,213 @@ class TIFFFile:
         :param y: Pixel Y coordinate
         :return: Signed 16-bit integer value representing the grayscale value of the pixel
         """
-        # Figure out which tile the pixel is in
-        tile_x = x / self.tiff_tileWidth
-        tile_y = y / self.tiff_tileLength
-
-        # Figure out the start of the tile data
+        tw = self._tw
+        tl = self._tl
+
+        # Figure out which tile the pixel is in and where it sits within
+        # that tile; power-of-two tile dimensions allow shift/mask in place
+        # of the two divisions and two modulos
+        if self._use_shift:
+            tile_x = x >> self._tw_shift
+            tile_y = y >> self._tl_shift
+            xt = x & self._tw_mask
+            yt = y & self._tl_mask
+        else:
+            tile_x = x // tw
+            tile_y = y // tl
+            xt = x % tw
+            yt = y % tl
+
+        # Figure out which tile holds the pixel data
         tile_idx = tile_y * self.tiff_tilesAcross + tile_x
-        tile_offset = self.tiff_tileOffsets[tile_idx]
 
-        # Now get the pixel within the tile
-        xt = x % self.tiff_tileWidth
-        yt = y % self.tiff_tileLength
+        return int(self._load_tile(tile_idx)[yt * tw + xt])
+
+    def _load_tile(self, tile_idx):
+        """
+        Returns the decoded pixel data for one tile, kept in a small LRU cache
+
+        Row-by-row sampling hits the same tile tileWidth consecutive times, so
+        keeping recently used tiles decoded avoids touching the mapped file
+        (and, without NumPy, re-unpacking the tile) once per pixel
+
+        :param tile_idx: Index into the tile offsets array
+        :return: Flat tile pixel data, indexable by yt * tileWidth + xt
+        """
+        tile = self._tile_cache.pop(tile_idx, None)
+        if tile is None:
+            tile_offset = self.tiff_tileOffsets[tile_idx]
+            if np is not None:
+                tile = np.frombuffer(self.mm, dtype='<i2',
+                                     count=self._tw * self._tl, offset=tile_offset)
+            else:
+                tile = self._tile_struct.unpack_from(self.mm, tile_offset)
+
+            # Evict the least recently used tile once the cache is full
+            if len(self._tile_cache) >= self._TILE_CACHE_SIZE:
+                self._tile_cache.popitem(last=False)
+
+        # Re-inserting the tile marks it as the most recently used
+        self._tile_cache[tile_idx] = tile
+        return tile
+
+    def read_region(self, start_x, start_y, end_x, end_y):
+        """
+        Reads a rectangular region of pixels in bulk, one tile at a time
+
+        Each tile that intersects the requested rectangle is decoded straight
+        from the memory map and the overlapping sub-rectangle is copied into
+        the output, which is far cheaper than calling get_pixel_val per pixel
+
+        :param start_x: Upper left X pixel coordinate (inclusive)
+        :param start_y: Upper left Y pixel coordinate (inclusive)
+        :param end_x: Lower right X pixel coordinate (exclusive)
+        :param end_y: Lower right Y pixel coordinate (exclusive)
+        :return: Region pixel values as a (end_y-start_y, end_x-start_x) NumPy
+                 int16 array, or a list of row lists when NumPy is unavailable
+        """
+        tw = self.tiff_tileWidth
+        tl = self.tiff_tileLength
+        width = end_x - start_x
+        height = end_y - start_y
+
+        # Let the OS start pulling in the needed tiles sequentially
+        self.prefetch_region(start_x, start_y, end_x, end_y)
+
+        if np is not None:
+            out = np.empty((height, width), dtype=np.int16)
+
+            # Hand the whole decode to the JIT kernel when Numba is around
+            if numba is not None:
+                buf = np.frombuffer(self.mm, dtype=np.uint8)
+                offsets = np.asarray(self.tiff_tileOffsets, dtype=np.int64)
+                _decode_region_jit(buf, offsets, int(self.tiff_tilesAcross),
+                                   tw, tl, start_x, start_y, out)
+                return out
+        else:
+            out = [[0] * width for _ in range(height)]
+
+        # Every tile that intersects the requested rectangle
+        tiles = [(tile_x, tile_y)
+                 for tile_y in range(start_y // tl, (end_y + tl - 1) // tl)
+                 for tile_x in range(start_x // tw, (end_x + tw - 1) // tw)]
+
+        def blit_tile(tile_xy):
+            (tile_x, tile_y) = tile_xy
+            tile_offset = self.tiff_tileOffsets[tile_y * self.tiff_tilesAcross + tile_x]
+
+            # Intersection of this tile with the request, in image coordinates
+            x0 = max(start_x, tile_x * tw)
+            x1 = min(end_x, (tile_x + 1) * tw)
+            y0 = max(start_y, tile_y * tl)
+            y1 = min(end_y, (tile_y + 1) * tl)
+
+            if np is not None:
+                tile = np.frombuffer(self.mm, dtype='<i2', count=tw * tl,
+                                     offset=tile_offset).reshape(tl, tw)
+                out[y0 - start_y:y1 - start_y, x0 - start_x:x1 - start_x] = \
+                    tile[y0 - tile_y * tl:y1 - tile_y * tl, x0 - tile_x * tw:x1 - tile_x * tw]
+            else:
+                # Decode the intersection one tile row at a time
+                row_struct = Struct('<%dh' % (x1 - x0))
+                for y in range(y0, y1):
+                    row_idx = tile_offset + ((y - tile_y * tl) * tw + (x0 - tile_x * tw)) * 2
+                    out[y - start_y][x0 - start_x:x1 - start_x] = row_struct.unpack_from(self.mm, row_idx)
+
+        if (ThreadPoolExecutor is not None and np is not None
+                and len(tiles) >= self._PARALLEL_TILE_MIN):
+            # Each tile writes a disjoint slice of out and NumPy releases the
+            # GIL during the copies, so the blits parallelize without locking
+            with ThreadPoolExecutor() as pool:
+                list(pool.map(blit_tile, tiles))
+        else:
+            for tile_xy in tiles:
+                blit_tile(tile_xy)
+
+        return out
+
+    def as_array(self):
+        """
+        Returns the whole image as a (ImageHeight, ImageWidth) int16 array
 
-        # Calculate the index within the tile
-        pixel_idx = (yt * self.tiff_tileWidth + xt) * 2 + tile_offset
-        self.f.seek(pixel_idx)
-        (pixel_val,) = unpack('h', self.f.read(2))
+        Assembles the logical raster from per-tile views of the memory map in
+        one pass (a single contiguous copy per tile), so downstream
+        NumPy/Numba consumers can skip the pixel-level API entirely
 
-        return pixel_val
+        :return: NumPy int16 array of every pixel value in the image
+        """
+        if np is None:
+            raise RuntimeError('TIFFFile.as_array requires NumPy')
+
+        tw = self._tw
+        tl = self._tl
+        width = self.tiff_ImageWidth
+        height = self.tiff_ImageHeight
+        out = np.empty((height, width), dtype=np.int16)
+
+        for tile_y in range(self.tiff_tilesDown):
+            for tile_x in range(self.tiff_tilesAcross):
+                tile_offset = self.tiff_tileOffsets[tile_y * self.tiff_tilesAcross + tile_x]
+                tile = np.frombuffer(self.mm, dtype='<i2', count=tw * tl,
+                                     offset=tile_offset).reshape(tl, tw)
+
+                # Edge tiles are stored at full size but only partially
+                # overlap the image, so clip the copy to the raster bounds
+                h = min(tl, height - tile_y * tl)
+                w = min(tw, width - tile_x * tw)
+                out[tile_y * tl:tile_y * tl + h, tile_x * tw:tile_x * tw + w] = tile[:h, :w]
+
+        return out
+
+    def prefetch_region(self, start_x, start_y, end_x, end_y):
+        """
+        Hints the OS to read ahead every tile the given region will touch
+
+        Tile data is not necessarily laid out in the file in scan order, so
+        reading a region row-major can degenerate into random I/O; advising
+        the needed tile ranges sorted by file offset lets the OS fetch them
+        sequentially instead (most useful on spinning disks and network
+        shares)
+
+        :param start_x: Upper left X pixel coordinate (inclusive)
+        :param start_y: Upper left Y pixel coordinate (inclusive)
+        :param end_x: Lower right X pixel coordinate (exclusive)
+        :param end_y: Lower right Y pixel coordinate (exclusive)
+        :return: None
+        """
+        tw = self._tw
+        tl = self._tl
+        tile_size = tw * tl * 2
+
+        # Collect the offsets of the tiles the region touches, in file order
+        tile_offsets = []
+        for tile_y in range(start_y // tl, (end_y + tl - 1) // tl):
+            row_base = tile_y * self.tiff_tilesAcross
+            for tile_x in range(start_x // tw, (end_x + tw - 1) // tw):
+                tile_offsets.append(int(self.tiff_tileOffsets[row_base + tile_x]))
+        tile_offsets.sort()
+
+        if hasattr(os, 'posix_fadvise'):
+            for tile_offset in tile_offsets:
+                os.posix_fadvise(self.f.fileno(), tile_offset, tile_size,
+                                 os.POSIX_FADV_WILLNEED)
+        else:
+            # No fadvise (Windows/IronPython); touching the mapped ranges in
+            # file order still primes the page cache sequentially
+            for tile_offset in tile_offsets:
+                self.mm[tile_offset:tile_offset + tile_size]
+
+    def close(self):
+        """
+        Unmaps and closes the underlying TIF file
+        :return: None
+        """
+        # Cached tiles may be zero-copy views of the mapping and would keep
+        # it from closing, so drop them first
+        self._tile_cache.clear()
+        if self.mm:
+            self.mm.close()
+            self.mm = None
+        if self.f:
+            self.f.close()
+            self.f = None
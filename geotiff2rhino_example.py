@@ -7,17 +7,30 @@ import GeoTIFF2Rhino
 import rhinoscriptsyntax as rs
 from System.Drawing import Color
 
+try:
+    import numpy as np
+except ImportError:
+    # Running under IronPython; fall back to per-pixel Python loops
+    np = None
+
+try:
+    import pack_points
+except ImportError:
+    # Optional C extension (build with 'python setup.py build_ext --inplace');
+    # the NumPy path below does the same work in a few more array passes
+    pack_points = None
+
 def main():
     tif_path = rs.OpenFileName('Choose TIF file', filter='TIF Files|*.tif', extension='.tif')
 
     if not tif_path:
-        print 'No TIF file path given!'
+        print('No TIF file path given!')
         return
 
     tfw_path = rs.OpenFileName('Choose TFW file', filter='TFW Files|*.tfw', extension='.tfw')
 
     if not tfw_path:
-        print 'No TFW file path given!'
+        print('No TFW file path given!')
         return
 
     tiff_file = GeoTIFF2Rhino.TIFFFile(tif_path)
@@ -29,29 +42,63 @@ def main():
     end_x = rs.GetInteger('Lower Right X Pixel Coordinate', tiff_file.tiff_ImageWidth, 0, tiff_file.tiff_ImageWidth)
     end_y = rs.GetInteger('Lower Right Y Pixel Coordinate', tiff_file.tiff_ImageHeight, 0, tiff_file.tiff_ImageHeight)
 
-    # Figure out the center of our slice of land
-    center_x = (start_x + end_x) / 2
-    center_y = (start_y + end_y) / 2
-    (center_x, center_y) = tfw_file.pixel_to_world(center_x, center_y)
-    print center_x, center_y
+    # Figure out the center of our slice of land, kept in pixel coordinates
+    # so the recentering folds into the (linear) world transform below
+    center_x_pix = (start_x + end_x) / 2.0
+    center_y_pix = (start_y + end_y) / 2.0
+    print(tfw_file.pixel_to_world(center_x_pix, center_y_pix))
 
-    # Sample all of the pixels in the desired region of the TIF
+    # Sample all of the pixels in the desired region of the TIF in one bulk
+    # read (a handful of tile copies instead of millions of per-pixel calls)
     # and generate a point cloud from them
-    v = []
-    for y in range(start_y, end_y):
-        for x in range(start_x, end_x):
-            z1 = tiff_file.get_pixel_val(x, y)
-
-            # Only use valid pixel data
-            if z1 != 32767:
-                (x1, y1) = tfw_file.pixel_to_world(x, y)
-
-                #Recenter the points about the origin
-                x1 -= center_x
-                y1 -= center_y
-                v.append(x1)
-                v.append(y1)
-                v.append(z1)
+    z = tiff_file.read_region(start_x, start_y, end_x, end_y)
+
+    if np is not None and pack_points is not None:
+        # The C extension fuses the nodata mask, recentering, scaling and
+        # x,y,z interleaving into a single pass over the region
+        (sx, sy) = tfw_file.pixel_to_world(1, 1)
+        pts = np.empty(int((z != 32767).sum()) * 3, dtype=np.float32)
+        pack_points.pack(pts, np.ascontiguousarray(z), z.shape[1],
+                         start_x, start_y, center_x_pix, center_y_pix,
+                         sx, sy, 32767)
+        v = pts.tolist()
+    elif np is not None:
+        # One vectorized comparison finds the valid pixels, and nonzero hands
+        # back their (row, col) indices directly, so the per-pixel nodata
+        # branch is gone and the full coordinate grids are never materialized
+        mask = z != 32767
+        ys, xs = np.nonzero(mask)
+
+        # Shifting the pixel coordinates by the center before scaling fuses
+        # the recentering into the transform: one subtract-and-multiply pass
+        # per axis instead of a multiply pass followed by a subtract pass
+        (x1, y1) = tfw_file.pixel_to_world_arr(xs + (start_x - center_x_pix),
+                                               ys + (start_y - center_y_pix))
+
+        # Assemble the interleaved x,y,z buffer in one preallocated array
+        # rather than appending tens of millions of Python floats to a list
+        # float32 easily holds int16 heights and recentered world coords, and
+        # halves the buffer size for multi-million point regions
+        pts = np.empty((len(xs), 3), dtype=np.float32)
+        pts[:, 0] = x1
+        pts[:, 1] = y1
+        pts[:, 2] = z[mask]
+        v = pts.reshape(-1).tolist()
+    else:
+        v = []
+        for y in range(start_y, end_y):
+            row = z[y - start_y]
+            for x in range(start_x, end_x):
+                z1 = row[x - start_x]
+
+                # Only use valid pixel data
+                if z1 != 32767:
+                    # Recentering about the origin happens in pixel space,
+                    # fused with the world transform
+                    (x1, y1) = tfw_file.pixel_to_world(x - center_x_pix, y - center_y_pix)
+                    v.append(x1)
+                    v.append(y1)
+                    v.append(z1)
 
     pc_layer = rs.AddLayer('Imported GeoTIFF PointCloud', Color.SandyBrown)
     rs.CurrentLayer(pc_layer)
@@ -0,0 +1,100 @@
+/* Optional one-pass point-cloud packer for geotiff2rhino_example
+ *
+ * pack(out, z, width, x0, y0, cx, cy, sx, sy, nodata) -> count
+ *
+ * Walks a sampled int16 region once and, for every pixel that is not the
+ * nodata value, writes the recentered world x, world y and height into the
+ * supplied float32 buffer as interleaved triples. Masking, centering,
+ * scaling and interleaving all happen in the one loop, which the compiler
+ * can keep in registers and auto-vectorize, instead of one NumPy pass each.
+ *
+ * Arguments:
+ *   out     writable buffer with room for count * 3 float32 values
+ *   z       readable buffer of int16 region samples, row-major
+ *   width   region width in pixels (number of columns per row)
+ *   x0, y0  pixel coordinates of the region's upper left corner
+ *   cx, cy  region center in pixel coordinates (points are recentered on it)
+ *   sx, sy  pixel -> meters scale factors per axis
+ *   nodata  sample value to skip (32767 for these GeoTIFFs)
+ *
+ * Returns the number of points written. Samples are assumed to be in host
+ * byte order (TIFF 'II' data on a little-endian host).
+ *
+ * Author: Dan Furie
+ * https://github.com/djfurie/GeoTIFF2Rhino
+ */
+#include <Python.h>
+
+static PyObject *
+pack_points_pack(PyObject *self, PyObject *args)
+{
+    Py_buffer out_buf, z_buf;
+    int width, x0, y0, nodata;
+    double cx, cy, sx, sy;
+    float *out;
+    const short *z;
+    Py_ssize_t n, cap, i, k = 0;
+    int col = 0, row = 0;
+
+    if (!PyArg_ParseTuple(args, "w*s*iiiddddi",
+                          &out_buf, &z_buf, &width, &x0, &y0,
+                          &cx, &cy, &sx, &sy, &nodata))
+        return NULL;
+
+    if (width <= 0) {
+        PyBuffer_Release(&out_buf);
+        PyBuffer_Release(&z_buf);
+        PyErr_SetString(PyExc_ValueError, "width must be positive");
+        return NULL;
+    }
+
+    out = (float *)out_buf.buf;
+    z = (const short *)z_buf.buf;
+    n = z_buf.len / (Py_ssize_t)sizeof(short);
+    cap = out_buf.len / (Py_ssize_t)(3 * sizeof(float));
+
+    for (i = 0; i < n; i++) {
+        int v = z[i];
+        if (v != nodata) {
+            if (k >= cap) {
+                PyBuffer_Release(&out_buf);
+                PyBuffer_Release(&z_buf);
+                PyErr_SetString(PyExc_ValueError, "output buffer too small");
+                return NULL;
+            }
+            out[k * 3 + 0] = (float)(((double)(x0 + col) - cx) * sx);
+            out[k * 3 + 1] = (float)(((double)(y0 + row) - cy) * sy);
+            out[k * 3 + 2] = (float)v;
+            k++;
+        }
+        if (++col == width) {
+            col = 0;
+            row++;
+        }
+    }
+
+    PyBuffer_Release(&out_buf);
+    PyBuffer_Release(&z_buf);
+    return PyLong_FromSsize_t(k);
+}
+
+static PyMethodDef pack_points_methods[] = {
+    {"pack", pack_points_pack, METH_VARARGS,
+     "pack(out, z, width, x0, y0, cx, cy, sx, sy, nodata) -> count\n"
+     "Packs valid samples into interleaved recentered float32 x,y,z triples."},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef pack_points_module = {
+    PyModuleDef_HEAD_INIT,
+    "pack_points",
+    "One-pass point-cloud packing for GeoTIFF2Rhino's example script.",
+    -1,
+    pack_points_methods
+};
+
+PyMODINIT_FUNC
+PyInit_pack_points(void)
+{
+    return PyModule_Create(&pack_points_module);
+}
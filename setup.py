@@ -0,0 +1,24 @@
+# Builds the optional pack_points C extension used by the example script:
+#
+#     python setup.py build_ext --inplace
+#
+# The example works without it (falling back to NumPy or pure Python), so
+# this only matters for CPython users who want the fastest packing path.
+import os
+
+from setuptools import Extension, setup
+
+if os.name == 'nt':
+    extra_compile_args = ['/O2']
+else:
+    # -march=native lets the compiler auto-vectorize the packing loop for
+    # the machine doing the building
+    extra_compile_args = ['-O3', '-march=native']
+
+setup(
+    name='pack_points',
+    ext_modules=[
+        Extension('pack_points', ['pack_points.c'],
+                  extra_compile_args=extra_compile_args),
+    ],
+)